@@ -1,4 +1,70 @@
+import hashlib
+import os
+import shutil
 import sys
+import tempfile
+
+
+def _cache_path(source):
+    """Get the path to the cached bytecode for a source file.
+
+    Parameters
+    ----------
+    source : bytes
+        The raw contents of the source file.
+
+    Returns
+    -------
+    path : str
+        The path where the compiled program is cached.
+    """
+    digest = hashlib.blake2b(source, digest_size=16)
+
+    # include the compiler itself in the key so that changes to the compiler
+    # invalidate previously compiled programs
+    package = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package)):
+        if name.endswith('.py'):
+            with open(os.path.join(package, name), 'rb') as f:
+                digest.update(f.read())
+
+    cache_root = (
+        os.environ.get('XDG_CACHE_HOME') or
+        os.path.join(os.path.expanduser('~'), '.cache')
+    )
+    return os.path.join(cache_root, 'um32', digest.hexdigest() + '.um')
+
+
+def _write_cache(cache_path, bytecode):
+    """Atomically store compiled bytecode in the cache.
+
+    Parameters
+    ----------
+    cache_path : str
+        The path returned by ``_cache_path``.
+    bytecode : bytes
+        The compiled program.
+
+    Notes
+    -----
+    The bytecode is written to a temporary file in the cache directory and
+    then renamed into place so that a crash or a concurrent compile never
+    leaves a truncated program behind a cache hit.
+    """
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(bytecode)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
 
 def main():
@@ -9,16 +75,29 @@ def main():
         )
         return -1
 
-    from compiler.ast import parse
-    from compiler.compiler import compile_ast
-
     try:
         out_path = sys.argv[2]
     except IndexError:
         out_path = 'a.um'
 
-    with open(sys.argv[1]) as source_file:
-        source = source_file.read()
+    with open(sys.argv[1], 'rb') as source_file:
+        raw_source = source_file.read()
+
+    # set UML_NO_CACHE=1 to always compile and never write to the cache
+    if os.environ.get('UML_NO_CACHE'):
+        cache_path = None
+    else:
+        cache_path = _cache_path(raw_source)
+        if os.path.exists(cache_path):
+            shutil.copyfile(cache_path, out_path)
+            return 0
+
+    from compiler.ast import parse
+    from compiler.compiler import compile_ast
+
+    # decode once; this skips the text layer's incremental decoding and
+    # newline translation
+    source = raw_source.decode('utf-8')
 
     tree = parse(source, filename=sys.argv[1])
     bytecode = compile_ast(tree)
@@ -26,6 +105,13 @@ def main():
     with open(out_path, 'wb') as out_file:
         out_file.write(bytecode)
 
+    if cache_path is not None:
+        try:
+            _write_cache(cache_path, bytecode)
+        except OSError as e:
+            # the cache is only an optimization, but say why it was skipped
+            print(f'warning: failed to cache bytecode: {e}', file=sys.stderr)
+
     return 0
 
 
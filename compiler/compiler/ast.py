@@ -1,158 +1,292 @@
 import ast
-import contextlib
+import enum
+from typing import NamedTuple, Union
 
-from .immutable import immutable
 
+class UMLType(enum.IntEnum):
+    uint = 0
+    array = 1
+    void = 2
 
-class Node(immutable):
-    __slots__ = ()
+    def __str__(self):
+        return self.name
 
+
+_types = {t.name: t for t in UMLType}
+
+# the largest value a uint literal may have
+_max_uint = 2 ** 32 - 1
+
+
+# Functions, arguments, locals and globals are created exactly once per name
+# by the translators, and literals are hash-consed, so identity is the same as
+# value equality and lets dict lookups use the C-level ``object`` slots. Each
+# non-empty if branch is its own node and static allocation; every empty
+# branch shares ``_empty_branch``.
+_by_identity = object.__hash__, object.__eq__
+
+
+# The remaining nodes compare by value, but like the old ``Node`` base class,
+# nodes of different types with the same fields, such as ``Call`` and
+# ``BuiltinCall`` or ``Return(x)`` and ``UIntLiteral(x)``, are never equal.
+def _by_type_and_fields():
+    """Create ``__hash__`` and ``__eq__`` methods that compare the fields like
+    a tuple but never consider nodes of different types equal.
+    """
     def __hash__(self):
-        return hash(
-            (type(self),) + tuple(getattr(self, s) for s in self.__slots__)
-        )
+        return hash((type(self), tuple.__hash__(self)))
 
     def __eq__(self, other):
-        if not isinstance(other, __class__):  # noqa
+        if type(other) is not type(self):
             return NotImplemented
 
-        return self.to_dict() == other.to_dict()
+        return tuple.__eq__(self, other)
 
+    return __hash__, __eq__
 
-class ArrayLiteral(Node):
-    __slots__ = 'value',
 
-    type = 'array'
+class ArrayLiteral(NamedTuple):
+    value: Union[tuple, bytes]
 
+    type = UMLType.array
 
-class UIntLiteral(Node):
-    __slots__ = 'value',
+    __hash__, __eq__ = _by_identity
 
-    type = 'uint'
 
+class UIntLiteral(NamedTuple):
+    value: int
 
-class For(Node):
-    __slots__ = 'target', 'iterator', 'body'
+    type = UMLType.uint
 
+    __hash__, __eq__ = _by_identity
 
-class Assignment(Node):
-    __slots__ = 'lhs', 'rhs'
 
+# Literals are hash-consed so that repeated values share a single node.
+_uint_literals = {n: UIntLiteral(n) for n in range(256)}
+_array_literals = {(): ArrayLiteral(())}
+# source string -> literal, so repeated strings are only checked and encoded
+# once
+_str_literals = {}
 
-class FunctionDef(Node):
-    __slots__ = 'name', 'args', 'locals', 'body', 'return_type'
 
-    def __hash__(self):
-        return hash((type(self), self.name))
+def uint_literal(value):
+    try:
+        return _uint_literals[value]
+    except KeyError:
+        _uint_literals[value] = literal = UIntLiteral(value)
+        return literal
 
-    def __eq__(self, other):
-        if not isinstance(other, __class__):  # noqa
-            return NotImplemented
 
-        return self.name == other.name
+def array_literal(value):
+    try:
+        return _array_literals[value]
+    except KeyError:
+        _array_literals[value] = literal = ArrayLiteral(value)
+        return literal
 
 
-class Return(Node):
-    __slots__ = 'value',
+class For(NamedTuple):
+    target: object
+    iterator: object
+    body: list
 
+    __hash__, __eq__ = _by_type_and_fields()
 
-class Argument(Node):
-    __slots__ = 'name', 'type'
 
-    def __hash__(self):
-        return hash((type(self), self.name))
+class Assignment(NamedTuple):
+    lhs: object
+    rhs: object
 
-    def __eq__(self, other):
-        if not isinstance(other, __class__):  # noqa
-            return NotImplemented
+    __hash__, __eq__ = _by_type_and_fields()
 
-        return self.name == other.name
 
+class FunctionDef(NamedTuple):
+    name: str
+    args: tuple
+    locals: tuple
+    body: list
+    return_type: UMLType
 
-class Local(Node):
-    __slots__ = 'name', 'type'
+    __hash__, __eq__ = _by_identity
 
-    def __hash__(self):
-        return hash((type(self), self.name))
 
-    def __eq__(self, other):
-        if not isinstance(other, __class__):  # noqa
-            return NotImplemented
+class Return(NamedTuple):
+    value: object
 
-        return self.name == other.name
+    __hash__, __eq__ = _by_type_and_fields()
 
 
-class Global(Node):
-    __slots__ = 'name', 'type', 'value'
+class Argument(NamedTuple):
+    name: str
+    type: UMLType
+    # the slot in the function's locals array
+    address: int = 0
 
-    def __hash__(self):
-        return hash((type(self), self.name))
+    __hash__, __eq__ = _by_identity
 
-    def __eq__(self, other):
-        if not isinstance(other, __class__):  # noqa
-            return NotImplemented
 
-        return self.name == other.name
+class Local(NamedTuple):
+    name: str
+    type: UMLType
+    # the slot in the function's locals array, after the arguments
+    address: int = 0
+
+    __hash__, __eq__ = _by_identity
+
 
+class Global(NamedTuple):
+    name: str
+    type: UMLType
+    value: object
 
-class Call(Node):
-    __slots__ = 'function', 'args', 'type'
+    __hash__, __eq__ = _by_identity
 
 
-class BuiltinCall(Node):
-    __slots__ = 'name', 'args', 'type'
+class Call(NamedTuple):
+    function: str
+    args: tuple
+    type: UMLType
+
+    __hash__, __eq__ = _by_type_and_fields()
+
+
+class BuiltinCall(NamedTuple):
+    name: str
+    args: tuple
+    type: UMLType
+
+    __hash__, __eq__ = _by_type_and_fields()
 
     valid = {
-        'len': ((Argument('arr', 'array'),), 'uint'),
-        'putchar': ((Argument('c', 'uint'),), 'void'),
-        'alloc': ((Argument('size', 'uint'),), 'array'),
-        'free': ((Argument('arr', 'array'),), 'void'),
-        'exit': ((), 'void'),
+        'len': ((Argument('arr', UMLType.array),), UMLType.uint),
+        'putchar': ((Argument('c', UMLType.uint),), UMLType.void),
+        'alloc': ((Argument('size', UMLType.uint),), UMLType.array),
+        'free': ((Argument('arr', UMLType.array),), UMLType.void),
+        'exit': ((), UMLType.void),
     }
 
 
-class BinOp(Node):
-    __slots__ = 'op', 'lhs', 'rhs'
+class BinOp(NamedTuple):
+    op: str
+    lhs: object
+    rhs: object
+
+    type = UMLType.uint
+
+    __hash__, __eq__ = _by_type_and_fields()
 
-    type = 'uint'
 
+class UnOp(NamedTuple):
+    op: str
+    operand: object
 
-class UnOp(Node):
-    __slots__ = 'op', 'operand'
+    type = UMLType.uint
 
-    type = 'uint'
+    __hash__, __eq__ = _by_type_and_fields()
 
 
-class Subscript(Node):
-    __slots__ = 'array', 'index'
+class Subscript(NamedTuple):
+    array: object
+    index: object
 
-    type = 'uint'
+    type = UMLType.uint
 
+    __hash__, __eq__ = _by_type_and_fields()
 
-class IfBranch(Node):
-    __slots__ = 'body',
 
+class IfBranch(NamedTuple):
+    body: tuple
 
-class If(Node):
-    __slots__ = 'test', 'true', 'false'
+    __hash__, __eq__ = _by_identity
 
 
-class _AstTranslator(ast.NodeVisitor):
-    def __init__(self, globals, functions, body, filename, lines):
+# Empty branches hold no nodes, so every ``If`` without an ``else`` can share
+# one.
+_empty_branch = IfBranch(())
+
+
+class If(NamedTuple):
+    test: object
+    true: IfBranch
+    false: IfBranch
+
+    __hash__, __eq__ = _by_type_and_fields()
+
+
+_binops = {
+    ast.Add: '+',
+    ast.Sub: '-',
+    ast.Mult: '*',
+    ast.Div: '/',
+}
+
+_unops = {
+    ast.UAdd: '+',
+    ast.USub: '-',
+    ast.Invert: '~',
+    ast.Not: 'not',
+}
+
+
+class _AstTranslator:
+    def __init__(self, globals, functions, body, filename, source):
         self.globals = globals
         self.functions = functions
         self.body = body
+        self.emit = body.append
         self.filename = filename
-        self.lines = lines
+        self.source = source
+        self._body_stack = []
 
-    @contextlib.contextmanager
-    def scoped_body(self):
-        old_body = self.body
-        self.body = body = []
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # resolve the ``visit_*`` methods once per class instead of building
+        # the method name and looking it up for every node visited
+        dispatch = {}
+        for name in dir(cls):
+            if not name.startswith('visit_'):
+                continue
+
+            node_type = getattr(ast, name[len('visit_'):], None)
+            if isinstance(node_type, type):
+                dispatch[node_type] = getattr(cls, name)
+
+        cls._dispatch = dispatch
+
+    def visit(self, node):
         try:
-            yield body
-        finally:
-            self.body = old_body
+            visitor = self._dispatch[type(node)]
+        except KeyError:
+            visitor = _AstTranslator.generic_visit
+
+        return visitor(self, node)
+
+    def generic_visit(self, node):
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        self.visit(item)
+            elif isinstance(value, ast.AST):
+                self.visit(value)
+
+    def _push_body(self):
+        self._body_stack.append(self.body)
+        self.body = body = []
+        self.emit = body.append
+        return body
+
+    def _pop_body(self):
+        self.body = body = self._body_stack.pop()
+        self.emit = body.append
+
+    def _expect_one(self, nodes, context, msg):
+        if len(nodes) != 1:
+            self.syntax_error(context, msg)
+
+        return nodes[0]
 
     def syntax_error(self, node, msg='invalid syntax'):
         raise SyntaxError(
@@ -160,7 +294,8 @@ class _AstTranslator(ast.NodeVisitor):
                 self.filename,
                 node.lineno,
                 node.col_offset + 1,
-                self.lines[node.lineno - 1],
+                # only split the source on the error path
+                self.source.splitlines()[node.lineno - 1],
             ),
         )
 
@@ -171,50 +306,70 @@ class _AstTranslator(ast.NodeVisitor):
         if not isinstance(node, ast.Name):
             self.syntax_error(node, 'type must be a name')
 
-        if node.id not in ('uint', 'array', 'void'):
+        type_ = _types.get(node.id)
+        if type_ is None:
             self.syntax_error(node, 'type must be uint, array or void')
 
-        return node.id
+        return type_
 
-    def visit_Num(self, node):
-        n = node.n
-        if n < 0 or n > 2 ** 32 - 1:
+    def _visit_num(self, node, n):
+        if not 0 <= n <= _max_uint:
             self.syntax_error(node, 'literal does not fit in a uint')
 
-        self.body.append(UIntLiteral(n))
+        self.emit(uint_literal(n))
 
-    def visit_Str(self, node):
-        s = node.s
+    def _visit_str(self, node, s):
+        literal = _str_literals.get(s)
+        if literal is None:
+            if not s.isascii():
+                self.syntax_error(node, 'string literal must be ascii')
 
-        try:
-            s = s.encode('ascii')
-        except ValueError:
-            self.syntax_error(node, 'string literal must be ascii')
+            # store the encoded bytes directly, iterating yields the same ints
+            _str_literals[s] = literal = array_literal(s.encode('ascii'))
 
-        self.body.append(ArrayLiteral(tuple(s)))
+        self.emit(literal)
 
     def visit_List(self, node):
         es = []
         for e in node.elts:
-            if not isinstance(e, ast.Num):
+            # ``isinstance(e, ast.Num)`` goes through a python-level
+            # ``__instancecheck__``; check the concrete types directly
+            if type(e) is not ast.Constant or type(e.value) is not int:
                 self.syntax_error(e, 'array literal may only contain uints')
 
-            n = e.n
-            if n < 0 or n > 2 ** 32 - 1:
-                self.syntax_error(e, 'literal does not fit in a uint')
+            es.append(e.value)
 
-            es.append(n)
+        if es and not (0 <= min(es) and max(es) <= _max_uint):
+            for e in node.elts:
+                if not 0 <= e.value <= _max_uint:
+                    self.syntax_error(e, 'literal does not fit in a uint')
 
-        self.body.append(ArrayLiteral(tuple(es)))
+        self.emit(array_literal(tuple(es)))
 
-    def visit_NameConstant(self, node):
+    def visit_Constant(self, node):
         value = node.value
+        if isinstance(value, str):
+            self._visit_str(node, value)
+        elif value is None or isinstance(value, bool):
+            self._visit_name_constant(value)
+        elif isinstance(value, int):
+            self._visit_num(node, value)
+        elif value is Ellipsis:
+            # ``...`` is a no-op, like a ``def f() -> void: ...`` body
+            pass
+        else:
+            self.syntax_error(
+                node,
+                f'UML does not support {type(value).__name__} literals',
+            )
+
+    def _visit_name_constant(self, value):
         if value is None:
-            self.body.append(UIntLiteral(0))
+            self.emit(uint_literal(0))
         elif value is True:
-            self.body.append(UIntLiteral(1))
+            self.emit(uint_literal(1))
         elif value is False:
-            self.body.append(UIntLiteral(0))
+            self.emit(uint_literal(0))
 
     def _outside_body(self, node):
         self.syntax_error(
@@ -249,31 +404,49 @@ class _AstTranslator(ast.NodeVisitor):
             self.syntax_error(node, 'UML does not support argument defaults')
 
         return [
-            Argument(arg.arg, self.process_annotation(arg.annotation, arg))
-            for arg in node.args
+            Argument(
+                arg.arg,
+                self.process_annotation(arg.annotation, arg),
+                address,
+            )
+            for address, arg in enumerate(node.args)
         ]
 
 
-class _GlobalFinder(_AstTranslator):
-    def visit_AnnAssign(self, node):
+class _TopLevelTranslator(_AstTranslator):
+    def collect(self, node):
+        # collect the global or function signature defined by a module level
+        # statement, or by the statements nested inside of it
+        node_type = type(node)
+        if node_type is ast.FunctionDef:
+            self.collect_signature(node)
+        elif node_type is ast.AnnAssign:
+            self.collect_global(node)
+        else:
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, ast.stmt):
+                    self.collect(child)
+
+    def collect_global(self, node):
         target = node.target
         if not isinstance(target, ast.Name):
             self.syntax_error(target, 'invalid lhs')
 
         name = target.id
         if name in self.globals:
-            self.syntax_error(f'redefinition of global variable {name!r}')
+            self.syntax_error(
+                node,
+                f'redefinition of global variable {name!r}',
+            )
 
         type_ = self.process_annotation(node.annotation, node)
-        with self.scoped_body() as rhs_nodes:
-            self.visit(node.value)
+        rhs_nodes = self._push_body()
+        self.visit(node.value)
+        self._pop_body()
 
-        assert len(rhs_nodes) == 1, (
-            f'incorrect number of  rhs nodes: {rhs_nodes}'
-        )
-        rhs, = rhs_nodes
+        rhs = self._expect_one(rhs_nodes, node.value, 'invalid rhs')
 
-        if rhs.type != type_:
+        if rhs.type is not type_:
             self.syntax_error(
                 node,
                 f'invalid assignment lhs :: {type_}, rhs :: {rhs.type}',
@@ -281,17 +454,18 @@ class _GlobalFinder(_AstTranslator):
 
         self.globals[name] = Global(name, type_, rhs)
 
-    def visit_FunctionDef(self, node):
+    def collect_signature(self, node):
         if node.name in self.functions:
-            self.syntax_error(node, 'redefinition of function {node.name!r}')
+            self.syntax_error(
+                node,
+                f'redefinition of function {node.name!r}',
+            )
 
         args = self.process_function_args(node.args)
         return_type = self.process_annotation(node.returns, node)
 
         self.functions[node.name] = args, return_type
 
-
-class _TopLevelTranslator(_AstTranslator):
     def visit_FunctionDef(self, node):
         if node.decorator_list:
             self.syntax_error(node, 'UML does not support decorators')
@@ -305,21 +479,16 @@ class _TopLevelTranslator(_AstTranslator):
             self.functions,
             body,
             self.filename,
-            self.lines,
+            self.source,
         )
         for n in node.body:
             t.visit(n)
 
-        argnames = {arg.name for arg in args}
-        self.body.append(
+        self.emit(
             FunctionDef(
                 name=node.name,
                 args=args,
-                locals=tuple(
-                    v
-                    for n, (k, v) in enumerate(t.namespace.items())
-                    if k not in argnames
-                ),
+                locals=tuple(t.locals),
                 body=body,
                 return_type=return_type,
             ),
@@ -330,90 +499,102 @@ class _FunctionTranslator(_AstTranslator):
     def __init__(self, arguments, return_type, *args, **kwarg):
         super().__init__(*args, **kwarg)
         self.namespace = {arg.name: arg for arg in arguments}
+        # the locals in definition order, excluding the arguments
+        self.locals = []
         self._return_type = return_type
+        self._first_local_address = len(arguments)
+
+    def _new_local(self, name, type_):
+        local = Local(
+            name,
+            type_,
+            self._first_local_address + len(self.locals),
+        )
+        self.namespace[name] = local
+        self.locals.append(local)
+        return local
 
     def visit_FunctionDef(self, node):
         self.syntax_error(node, 'UML does not support closures')
 
-    _binoptable = {
-        ast.Add: '+',
-        ast.Sub: '-',
-        ast.Mult: '*',
-        ast.Div: '/',
-    }
-
     def visit_BinOp(self, node):
-        try:
-            op = self._binoptable[type(node.op)]
-        except KeyError:
-            self.syntax_error(node, 'unknown operator')
-
-        with self.scoped_body() as operands:
-            self.visit(node.left)
+        # Walk down the left spine iteratively so that long chains like
+        # ``a + b + c + ...`` don't recurse once per operator.
+        spine = []
+        while isinstance(node, ast.BinOp):
+            op = _binops.get(type(node.op))
+            if op is None:
+                self.syntax_error(node, 'unknown operator')
+
+            spine.append((node, op))
+            node = node.left
+
+        operands = self._push_body()
+        self.visit(node)
+        lhs = self._expect_one(operands, node, 'invalid operand')
+        for node, op in reversed(spine):
+            operands.clear()
             self.visit(node.right)
+            rhs = self._expect_one(operands, node.right, 'invalid operand')
 
-        assert len(operands) == 2, f'incorrect number of operands: {operands}'
-        lhs, rhs = operands
-
-        if lhs.type != 'uint':
-            self.syntax_error(
-                node.left,
-                f'cannot add operand of type {lhs.type}',
-            )
-        if rhs.type != 'uint':
-            self.syntax_error(
-                node.right,
-                f'cannot add operand of type {rhs.type}',
-            )
-        self.body.append(BinOp(op, lhs, rhs))
+            if lhs.type is not UMLType.uint:
+                self.syntax_error(
+                    node.left,
+                    f'cannot add operand of type {lhs.type}',
+                )
+            if rhs.type is not UMLType.uint:
+                self.syntax_error(
+                    node.right,
+                    f'cannot add operand of type {rhs.type}',
+                )
+            lhs = BinOp(op, lhs, rhs)
+        self._pop_body()
 
-    _unoptable = {
-        ast.UAdd: '+',
-        ast.USub: '-',
-        ast.Invert: '~',
-        ast.Not: 'not',
-    }
+        self.emit(lhs)
 
     def visit_UnaryOp(self, node):
-        try:
-            op = self._unoptable[type(node.op)]
-        except KeyError:
+        op = _unops.get(type(node.op))
+        if op is None:
             self.syntax_error(node, 'unknown operator')
 
-        with self.scoped_body() as operand:
-            self.visit(node.operand)
-
-        if len(operand) != 1:
-            self.syntax_error(node.operand, 'invalid unary operand')
+        operand = self._push_body()
+        self.visit(node.operand)
+        self._pop_body()
 
-        self.body.append(UnOp(op, operand[0]))
+        operand = self._expect_one(
+            operand,
+            node.operand,
+            'invalid unary operand',
+        )
+        self.emit(UnOp(op, operand))
 
     def visit_Return(self, node):
         if node.value is None:
-            if self.return_type == 'array':
-                self.body.append(Return(ArrayLiteral([])))
-            elif self.return_type == 'uint':
-                self.body.append(Return(UIntLiteral(0)))
+            if self._return_type is UMLType.array:
+                self.emit(Return(array_literal(())))
+            elif self._return_type is UMLType.uint:
+                self.emit(Return(uint_literal(0)))
             else:
-                self.body.Append(Return(None))
+                self.emit(Return(None))
             return
 
-        with self.scoped_body() as return_value:
-            self.visit(node.value)
+        return_value = self._push_body()
+        self.visit(node.value)
+        self._pop_body()
 
-        assert len(return_value) == 1, (
-            f'incorrect number of return value nodes: {return_value}'
+        return_node = self._expect_one(
+            return_value,
+            node.value,
+            'invalid return value',
         )
-
-        return_node, = return_value
-        if return_node.type != self._return_type:
+        if return_node.type is not self._return_type:
             self.syntax_error(
                 node.value,
                 f'cannot return value of type {return_node.type} in a'
                 f' function with return type {self._return_type}',
             )
 
-        self.body.append(Return(return_node))
+        self.emit(Return(return_node))
 
     def visit_Call(self, node):
         if (isinstance(node.func, ast.Attribute) and
@@ -434,9 +615,10 @@ class _FunctionTranslator(_AstTranslator):
             qualname = name = node.func.id
             arg_defs, return_type = self.functions[name]
 
-        with self.scoped_body() as args:
-            for arg in node.args:
-                self.visit(arg)
+        args = self._push_body()
+        for arg in node.args:
+            self.visit(arg)
+        self._pop_body()
 
         if len(args) != len(arg_defs):
             self.syntax_error(
@@ -448,7 +630,7 @@ class _FunctionTranslator(_AstTranslator):
 
         it = enumerate(zip(node.args, args, arg_defs))
         for n, (py_node, arg_node, arg_definition) in it:
-            if arg_node.type != arg_definition.type:
+            if arg_node.type is not arg_definition.type:
                 self.syntax_error(
                     py_node,
                     f'argument {n} is expected to be of type'
@@ -456,161 +638,162 @@ class _FunctionTranslator(_AstTranslator):
                     f' {arg_node.type}',
                 )
 
-        self.body.append(type_(name, tuple(args), return_type))
+        self.emit(type_(name, tuple(args), return_type))
 
     def visit_For(self, node):
         if node.orelse:
             self.syntax_error(node, 'UML does not support for-else')
 
-        with self.scoped_body() as target:
-            self.visit(node.target)
+        target = self._push_body()
+        self.visit(node.target)
+        self._pop_body()
 
         if not target:
             if not isinstance(node.target, ast.Name):
                 self.syntax_error(node.target, 'invalid loop target')
 
             name = node.target.id
-            self.namespace[name] = target = Local(name, 'uint')
+            target = self._new_local(name, UMLType.uint)
         else:
-            assert len(target) == 1, (
-                f'incorrect number of target nodes: {target}'
+            target = self._expect_one(
+                target,
+                node.target,
+                'invalid loop target',
             )
-            target, = target
 
         if not isinstance(target, (Local, Argument)):
             self.syntax_error(node.target, 'invalid loop target')
 
-        with self.scoped_body() as iterator:
-            self.visit(node.iter)
+        iterator = self._push_body()
+        self.visit(node.iter)
+        self._pop_body()
 
-        assert len(iterator) == 1, (
-            f'incorrect number of iterator nodes: {iterator}'
-        )
-        iterator, = iterator
-        if iterator.type != 'array':
+        iterator = self._expect_one(iterator, node.iter, 'invalid iterator')
+        if iterator.type is not UMLType.array:
             self.syntax_error(
                 node.iter,
                 f'cannot iterate over values of type {iterator.type}',
             )
 
-        with self.scoped_body() as body:
-            for n in node.body:
-                self.visit(n)
+        body = self._push_body()
+        for n in node.body:
+            self.visit(n)
+        self._pop_body()
 
-        self.body.append(For(
+        self.emit(For(
             target,
             iterator,
             body,
         ))
 
     def visit_If(self, node):
-        with self.scoped_body() as test:
-            self.visit(node.test)
+        test = self._push_body()
+        self.visit(node.test)
+        self._pop_body()
 
-        if len(test) != 1:
-            self.syntax_error(node.test, 'invalid condition')
-
-        test, = test
-        if test.type != 'uint':
+        test = self._expect_one(test, node.test, 'invalid condition')
+        if test.type is not UMLType.uint:
             self.syntax_error(
                 node.test,
                 f'condition must be of type uint, got expression of type'
                 f' {test.type}',
             )
 
-        with self.scoped_body() as true:
-            for n in node.body:
-                self.visit(n)
+        true = self._push_body()
+        for n in node.body:
+            self.visit(n)
+        self._pop_body()
 
-        with self.scoped_body() as false:
-            for n in node.orelse:
-                self.visit(n)
+        false = self._push_body()
+        for n in node.orelse:
+            self.visit(n)
+        self._pop_body()
 
-        self.body.append(If(
+        self.emit(If(
             test,
-            IfBranch(tuple(true)),
-            IfBranch(tuple(false)),
+            IfBranch(tuple(true)) if true else _empty_branch,
+            IfBranch(tuple(false)) if false else _empty_branch,
         ))
 
     def visit_Subscript(self, node):
-        with self.scoped_body() as arr:
-            self.visit(node.value)
-
-        if len(arr) != 1:
-            self.syntax_error(node.value, 'invalid array for subscript')
-
-        arr, = arr
-        if arr.type != 'array':
+        arr = self._push_body()
+        self.visit(node.value)
+        self._pop_body()
+
+        arr = self._expect_one(
+            arr,
+            node.value,
+            'invalid array for subscript',
+        )
+        if arr.type is not UMLType.array:
             self.syntax_error(node.value, 'can only index arrays')
 
-        with self.scoped_body() as ix:
-            self.visit(node.slice)
+        ix = self._push_body()
+        self.visit(node.slice)
+        self._pop_body()
 
-        if not len(ix) == 1:
-            self.syntax_error(node.slice, 'invalid index')
-        ix, = ix
+        ix = self._expect_one(ix, node.slice, 'invalid index')
 
-        if ix.type != 'uint':
+        if ix.type is not UMLType.uint:
             self.syntax_error(node.slice, 'index must be a uint')
 
-        self.body.append(Subscript(arr, ix))
+        self.emit(Subscript(arr, ix))
 
     def visit_Name(self, node):
-        if isinstance(node.ctx, ast.Load):
-            if node.id not in self.namespace and node.id not in self.globals:
-                self.syntax_error(node, f'undefined variable {node.id!r}')
+        if type(node.ctx) is ast.Load:
+            name = node.id
+            value = self.namespace.get(name)
+            if value is None:
+                value = self.globals.get(name)
+                if value is None:
+                    self.syntax_error(node, f'undefined variable {name!r}')
 
-            if node.id in self.namespace:
-                self.body.append(self.namespace[node.id])
-            else:
-                self.body.append(self.globals[node.id])
+            self.emit(value)
 
     def _assign_name_lhs(self, node, target):
         name = target.id
-        try:
-            return self.namespace[name]
-        except KeyError:
+        lhs = self.namespace.get(name)
+        if lhs is None:
             self.syntax_error(target, f'undefined variable {name!r}')
 
-    def _assign_subscript_lhs(self, node, target):
-        with self.scoped_body() as lhs:
-            self.visit(target)
+        return lhs
 
-        if not len(lhs) == 1:
-            self.syntax_error(target, 'invalid assignment target')
+    def _assign_subscript_lhs(self, node, target):
+        lhs = self._push_body()
+        self.visit(target)
+        self._pop_body()
 
-        return lhs[0]
+        return self._expect_one(lhs, target, 'invalid assignment target')
 
     def visit_Assign(self, node):
         if len(node.targets) > 1:
             self.syntax_error(node, 'UML does not support multiple assignment')
 
         target, = node.targets
-        if not isinstance(target, (ast.Name, ast.Subscript)):
+        target_type = type(target)
+        if target_type is not ast.Name and target_type is not ast.Subscript:
             self.syntax_error(target, 'invalid lhs')
 
-        with self.scoped_body() as rhs_nodes:
-            self.visit(node.value)
+        rhs_nodes = self._push_body()
+        self.visit(node.value)
+        self._pop_body()
 
-        assert len(rhs_nodes) == 1, (
-            f'incorrect number of rhs nodes: {rhs_nodes}'
-        )
-        rhs, = rhs_nodes
+        rhs = self._expect_one(rhs_nodes, node.value, 'invalid rhs')
 
-        if isinstance(target, ast.Name):
+        if target_type is ast.Name:
             lhs = self._assign_name_lhs(node, target)
-        elif isinstance(target, ast.Subscript):
+        elif target_type is ast.Subscript:
             lhs = self._assign_subscript_lhs(node, target)
         else:
             self.syntax_error(target, 'invalid assignment target')
 
-        if rhs.type != lhs.type:
+        if rhs.type is not lhs.type:
             self.syntax_error(
                 node,
                 f'invalid assignment lhs :: {lhs.type}, rhs :: {rhs.type}',
             )
 
-        self.body.append(Assignment(lhs, rhs))
+        self.emit(Assignment(lhs, rhs))
 
 
     def visit_AnnAssign(self, node):
@@ -623,40 +806,52 @@ class _FunctionTranslator(_AstTranslator):
             self.syntax_error(node, f'redefinition of local variable {name!r}')
 
         type_ = self.process_annotation(node.annotation, node)
-        with self.scoped_body() as rhs_nodes:
-            self.visit(node.value)
+        rhs_nodes = self._push_body()
+        self.visit(node.value)
+        self._pop_body()
 
-        assert len(rhs_nodes) == 1, (
-            f'incorrect number of  rhs nodes: {rhs_nodes}'
-        )
-        rhs, = rhs_nodes
+        rhs = self._expect_one(rhs_nodes, node.value, 'invalid rhs')
 
-        if rhs.type != type_:
+        if rhs.type is not type_:
             self.syntax_error(
                 node,
                 f'invalid assignment lhs :: {type_}, rhs :: {rhs.type}',
             )
 
-        lhs = Local(name, type_)
-        self.namespace[name] = lhs
-        self.body.append(Assignment(lhs, rhs))
+        lhs = self._new_local(name, type_)
+        self.emit(Assignment(lhs, rhs))
 
 
 def parse(source, filename='<unknown>'):
     tree = ast.parse(source, filename=filename)
-    lines = source.splitlines()
 
     globals_ = {}
     functions = {}
-
-    _GlobalFinder(globals_, functions, [], lines, filename).visit(tree)
-
     body = []
-    _TopLevelTranslator(
+    translator = _TopLevelTranslator(
         globals_,
         functions,
         body,
         filename,
-        source.splitlines(),
-    ).visit(tree)
+        source,
+    )
+
+    # collect all of the globals and function signatures before translating
+    # any function bodies so that functions may reference names defined later
+    # in the module
+    for node in tree.body:
+        translator.collect(node)
+
+    for node in tree.body:
+        node_type = type(node)
+        if node_type is ast.FunctionDef:
+            translator.visit_FunctionDef(node)
+        elif node_type is not ast.AnnAssign:
+            # other statements only contribute the functions defined inside of
+            # them
+            nodes = translator._push_body()
+            translator.visit(node)
+            translator._pop_body()
+            body.extend(n for n in nodes if type(n) is FunctionDef)
+
     return body
@@ -1,22 +1,31 @@
-from functools import singledispatch, partial
-from itertools import chain
+from functools import partial
 import operator
+from operator import index
+import os
+import struct
 import sys
 
 from . import ast
 from . import instructions as instrs
-from .immutable import immutable
 from .runtime_constants import Register, STACK_SIZE
 
 
 def _static_allocations_without_literal_arrays(nodes):
-    for n, node in enumerate(nodes):
-        if ((isinstance(node, ast.Global) and node.type == 'array') or
-                isinstance(node, ast.FunctionDef)):
-            yield node, n
+    # addresses are handed out in insertion order, so they must be dense for
+    # ``Context.static_address`` to keep using ``len`` as the next address
+    allocated = (
+        node for node in nodes
+        if ((isinstance(node, ast.Global) and
+             node.type is ast.UMLType.array) or
+            isinstance(node, ast.FunctionDef))
+    )
+    for n, node in enumerate(allocated):
+        yield node, n
 
 
 class OccupiedRegister:
+    __slots__ = '_underlying_register', '_allocator'
+
     def __init__(self, underlying_register, allocator):
         self._underlying_register = underlying_register
         self._allocator = allocator
@@ -25,8 +34,10 @@ class OccupiedRegister:
         return self._underlying_register
 
     def release(self):
-        self._allocator._given_out.pop()
-        self._allocator._registers.append(self._underlying_register)
+        allocator = self._allocator
+        if allocator._track:
+            del allocator._given_out[self._underlying_register]
+        allocator._registers.append(self._underlying_register)
 
     def __enter__(self):
         return self
@@ -36,16 +47,27 @@ class OccupiedRegister:
 
 
 class RegisterAllocator:
-    def __init__(self):
+    def __init__(self, track=False):
         self._registers = [Register.ax, Register.bx, Register.cx, Register.dx]
-        self._given_out = []
+        # live register -> (file, line) of the occupy() call, only recorded
+        # when tracking
+        self._given_out = {}
+        self._track = track
 
     def _format_given_out(self):
+        if not self._track:
+            return 'unknown (set UML_DEBUG_REGS=1 to record allocation sites)'
+
         return '\n  '.join(
             f'{n}: {file}:{line}'
-            for n, (file, line) in enumerate(self._given_out, 1)
+            for n, (file, line) in enumerate(self._given_out.values(), 1)
         )
 
+    def available(self):
+        """The number of registers that are not currently occupied.
+        """
+        return len(self._registers)
+
     def occupy(self):
         try:
             underlying = self._registers.pop()
@@ -55,33 +77,56 @@ class RegisterAllocator:
                 f' out at:\n  {self._format_given_out()}',
             )
 
-        frame = sys._getframe(1)
-        self._given_out.append((frame.f_code.co_filename, frame.f_lineno))
+        if self._track:
+            frame = sys._getframe(1)
+            self._given_out[underlying] = (
+                frame.f_code.co_filename,
+                frame.f_lineno,
+            )
         return OccupiedRegister(underlying, self)
 
 
-class Context(immutable):
+def _holds(body, register, value):
+    # Whether ``register`` is known to hold ``value`` at the end of ``body``
+    # because of an earlier orthography. Only the last few instructions are
+    # searched, and a LoadProgram ends the search because execution may
+    # resume right after it with different register contents.
+    register = index(register)
+    for instr in reversed(body[-16:]):
+        if type(instr) is instrs.LoadProgram:
+            return False
+
+        output = instr.output_register
+        if output == register:
+            return type(instr) is instrs.Orthography and instr.value == value
+
+    return False
+
+
+class Context:
     __slots__ = (
         'static_allocations',
         'function_bodies',
+        'functions',
         'registers',
-        'locals',
         'current_array_address',
     )
 
     def __init__(self,
                  static_allocations,
                  function_bodies,
+                 functions,
                  registers=None,
-                 locals=None,
                  current_array_address=None):
         if registers is None:
-            registers = RegisterAllocator()
+            registers = RegisterAllocator(
+                track=bool(os.environ.get('UML_DEBUG_REGS')),
+            )
 
         self.static_allocations = static_allocations
         self.function_bodies = function_bodies
+        self.functions = functions
         self.registers = registers
-        self.locals = locals
         self.current_array_address = current_array_address
 
     def static_address(self, node):
@@ -90,174 +135,270 @@ class Context(immutable):
             len(self.static_allocations),
         )
 
-    def immediate(self, register, value):
-        return instrs.Immediate(register, value, self.registers)
+    def immediate(self, body, register, value):
+        if value <= instrs.Orthography.max_value:
+            # the common case: the value fits in a single orthography
+            if not _holds(body, register, value):
+                body.append(instrs.Orthography(register, value))
+            return
 
-    def push(self, register):
-        return instrs.Push(register, self.registers)
+        body.extend(
+            instrs.Immediate(
+                register,
+                value,
+                self.registers,
+            ).low_level_instructions(),
+        )
 
-    def pop(self, register):
-        return instrs.Pop(register, self.registers)
+    def constant(self, body, register, value):
+        max_value = instrs.Orthography.max_value
+        if value <= max_value or ~value & 0xffffffff <= max_value:
+            self.immediate(body, register, value)
+            return
 
+        # Large values take up to five instructions and a scratch register
+        # to build; store them once in the PIC table and load them from there
+        # instead.
+        self.load_indexed(
+            body,
+            register,
+            Register.pic_table,
+            self.static_address(ast.uint_literal(value)),
+        )
 
-@singledispatch
-def compile_node(node, ctx):
-    raise NotImplementedError(
-        f'cannot compile node of type {type(node).__name__}',
-    )
+    def load_indexed(self, body, out, array, index):
+        self.immediate(body, out, index)
+        body.append(instrs.ArrayIndex(out, array, out))
+
+    def store_indexed(self, body, array, index, value):
+        with self.registers.occupy() as ix:
+            self.immediate(body, ix, index)
+            body.append(instrs.ArrayAmmendment(array, ix, value))
+
+    # the push step is loaded through ``immediate`` so that back to back
+    # pushes reuse the 1 already sitting in a scratch register; the pop step
+    # is built with the complement lowering, which always ends in a NotAnd, so
+    # pops always rebuild it
+    def push(self, body, register):
+        body.append(
+            instrs.ArrayAmmendment(
+                Register.stack,
+                Register.stack_top,
+                register,
+            ),
+        )
+        with self.registers.occupy() as step:
+            self.immediate(body, step, 1)
+            body.append(
+                instrs.Addition(Register.stack_top, Register.stack_top, step),
+            )
 
+    def pop(self, body, register):
+        with self.registers.occupy() as step:
+            self.immediate(body, step, -1 % 2 ** 32)
+            body.append(
+                instrs.Addition(Register.stack_top, Register.stack_top, step),
+            )
+        body.append(
+            instrs.ArrayIndex(register, Register.stack, Register.stack_top),
+        )
 
-@compile_node.register(ast.FunctionDef)
-def _compile_function_def(node, ctx):
-    locals_ = {l: n for n, l in enumerate(chain(node.args, node.locals))}
-    ctx = ctx.update(
-        locals=locals_,
-        current_array_address=ctx.static_allocations[node],
-    )
 
-    with ctx.registers.occupy() as imm:
-        yield ctx.immediate(imm, len(node.locals) + len(node.args))
-        yield instrs.Allocation(Register.locals, imm)
+def _register(impls, type_):
+    def register(f):
+        impls[type_] = f
+        return f
 
-    if node.args:
-        with ctx.registers.occupy() as return_address:
-            yield ctx.pop(return_address)
+    return register
+
+
+_compile_node_impls = {}
+
+
+def compile_node(node, ctx, body):
+    try:
+        impl = _compile_node_impls[type(node)]
+    except KeyError:
+        raise NotImplementedError(
+            f'cannot compile node of type {type(node).__name__}',
+        )
 
-            for n in range(len(node.args)):
-                with ctx.registers.occupy() as arg:
-                    yield ctx.pop(arg)
-                    with ctx.registers.occupy() as ix:
-                        yield ctx.immediate(ix, n)
+    return impl(node, ctx, body)
 
-                        yield instrs.ArrayAmmendment(Register.locals, ix, arg)
 
-            yield ctx.push(return_address)
+compile_node.register = partial(_register, _compile_node_impls)
+
+
+@compile_node.register(ast.FunctionDef)
+def _compile_function_def(node, ctx, body):
+    ctx.current_array_address = ctx.static_allocations[node]
+
+    with ctx.registers.occupy() as imm:
+        ctx.immediate(body, imm, len(node.locals) + len(node.args))
+        body.append(instrs.Allocation(Register.locals, imm))
+
+    # the caller pushes the return address before the arguments, so they can
+    # be popped straight off the top of the stack
+    if node.args:
+        _pop_arguments(ctx, body, len(node.args))
 
     for subnode in node.body:
-        yield from compile_node(subnode, ctx)
+        compile_node(subnode, ctx, body)
 
-    yield instrs.Abandonment(Register.locals)
+    body.append(instrs.Abandonment(Register.locals))
 
     if node.name == 'main':
-        yield instrs.Halt()
+        body.append(instrs.Halt())
     else:
         with ctx.registers.occupy() as return_array, \
                 ctx.registers.occupy() as return_address:
-            yield ctx.pop(return_address)
-            yield ctx.pop(return_array)
+            ctx.pop(body, return_address)
+            ctx.pop(body, return_array)
 
             # restore locals
-            yield ctx.pop(Register.locals)
+            ctx.pop(body, Register.locals)
+
+            body.append(instrs.LoadProgram(return_array, return_address))
 
-            yield instrs.LoadProgram(return_array, return_address)
+
+def _pop_arguments(ctx, body, count):
+    # args[0] is on top of the stack; drop all of the arguments with a single
+    # stack_top adjustment and then copy each one into its local slot
+    with ctx.registers.occupy() as imm:
+        ctx.constant(body, imm, -count % 2 ** 32)
+        body.append(
+            instrs.Addition(Register.stack_top, Register.stack_top, imm),
+        )
+
+    for n in range(count):
+        with ctx.registers.occupy() as arg:
+            offset = count - 1 - n
+            if offset:
+                with ctx.registers.occupy() as ix:
+                    ctx.immediate(body, ix, offset)
+                    body.append(instrs.Addition(ix, Register.stack_top, ix))
+                    body.append(instrs.ArrayIndex(arg, Register.stack, ix))
+            else:
+                body.append(
+                    instrs.ArrayIndex(arg, Register.stack, Register.stack_top),
+                )
+
+            ctx.store_indexed(body, Register.locals, n, arg)
 
 
 @compile_node.register(ast.If)
-def _compile_if(node, ctx):
-    # recursively compile the branches
-    true_ctx = ctx.update(current_array_address=ctx.static_address(node.true))
-    ctx.function_bodies[node.true] = list(
-        _ll_instrs(compile_node(node.true, true_ctx)),
-    )
-    false_ctx = ctx.update(
-        current_array_address=ctx.static_address(node.false),
-    )
-    ctx.function_bodies[node.false] = list(
-        _ll_instrs(compile_node(node.false, false_ctx)),
-    )
+def _compile_if(node, ctx, body):
+    # recursively compile the branches, each into its own array
+    current_array_address = ctx.current_array_address
+
+    for branch in node.true, node.false:
+        if branch in ctx.function_bodies:
+            # the empty branch is shared by every ``If``; compile it once
+            continue
+
+        ctx.current_array_address = ctx.static_address(branch)
+        ctx.function_bodies[branch] = branch_body = []
+        compile_node(branch, ctx, branch_body)
+
+    ctx.current_array_address = current_array_address
 
     with ctx.registers.occupy() as current_address:
-        yield ctx.immediate(current_address, ctx.current_array_address)
-        yield instrs.ArrayIndex(
+        ctx.load_indexed(
+            body,
             current_address,
             Register.pic_table,
-            current_address,
+            ctx.current_array_address,
         )
-        yield ctx.push(current_address)
+        ctx.push(body, current_address)
 
     with ctx.registers.occupy() as false:
-        with (yield from compute_into_register(node.test, ctx)) as test, \
+        with compute_into_register(node.test, ctx, body) as test, \
                 ctx.registers.occupy() as true:
-            yield ctx.immediate(true, ctx.static_address(node.true))
-            yield instrs.ArrayIndex(true, Register.pic_table, true)
-
-            yield ctx.immediate(false, ctx.static_address(node.false))
-            yield instrs.ArrayIndex(false, Register.pic_table, false)
+            ctx.load_indexed(
+                body,
+                true,
+                Register.pic_table,
+                ctx.static_address(node.true),
+            )
+            ctx.load_indexed(
+                body,
+                false,
+                Register.pic_table,
+                ctx.static_address(node.false),
+            )
 
-            ret_address = yield instrs.ConditionalMove(false, true, test)
+            body.append(instrs.ConditionalMove(false, true, test))
             selected_branch_address = false
 
+        return_address = instrs.Address()
         with ctx.registers.occupy() as imm:
-            # use an orthography instead of immediate to ensure a fixed size
-            # between the address and the place to resume
-            yield instrs.Orthography(imm, ret_address + 6)
-            yield ctx.push(imm)
+            # the return address is filled in once the jump has been emitted
+            body.append(instrs.Orthography(imm, return_address))
+            ctx.push(body, imm)
 
-            yield instrs.Orthography(imm, 0)
-            yield instrs.LoadProgram(selected_branch_address, imm)
+            ctx.immediate(body, imm, 0)
+            body.append(instrs.LoadProgram(selected_branch_address, imm))
+
+    return_address.value = len(body)
 
 
 @compile_node.register(ast.IfBranch)
-def _compile_if_branch(node, ctx):
+def _compile_if_branch(node, ctx, body):
     for subnode in node.body:
-        yield from compile_node(subnode, ctx)
+        compile_node(subnode, ctx, body)
 
     with ctx.registers.occupy() as return_array, \
             ctx.registers.occupy() as return_address:
-        yield ctx.pop(return_address)
-        yield ctx.pop(return_array)
+        ctx.pop(body, return_address)
+        ctx.pop(body, return_array)
 
-        yield instrs.LoadProgram(return_array, return_address)
+        body.append(instrs.LoadProgram(return_array, return_address))
 
 
 @compile_node.register(ast.Call)
-def _compile_call(node, ctx):
-    return _call(False, node, ctx)
+def _compile_call(node, ctx, body):
+    _call(False, node, ctx, body)
 
 
-def _call(expr, node, ctx):
-    assert not (node.type == 'void' and expr), (
+def _call(expr, node, ctx, body):
+    assert not (node.type is ast.UMLType.void and expr), (
         'cannot use void call in expression'
     )
 
     # save the current locals
-    yield ctx.push(Register.locals)
+    ctx.push(body, Register.locals)
 
     with ctx.registers.occupy() as current_address:
-        yield ctx.immediate(current_address, ctx.current_array_address)
-        yield instrs.ArrayIndex(
+        ctx.load_indexed(
+            body,
             current_address,
             Register.pic_table,
-            current_address,
+            ctx.current_array_address,
         )
-        yield ctx.push(current_address)
+        ctx.push(body, current_address)
+
+    return_address = instrs.Address()
+    with ctx.registers.occupy() as imm:
+        # the return address is filled in once the jump has been emitted
+        body.append(instrs.Orthography(imm, return_address))
+        ctx.push(body, imm)
 
     # compute args rtl so that TOS is args[0] when we are done
     for arg in reversed(node.args):
-        with (yield from compute_into_register(arg, ctx)) as r:
-            yield ctx.push(r)
+        with compute_into_register(arg, ctx, body) as r:
+            ctx.push(body, r)
 
     with ctx.registers.occupy() as call_addr:
-        function_address = ctx.static_allocations[ast.FunctionDef(
-            node.function,
-            (),
-            (),
-            (),
-            node.type,
-        )]
-        yield ctx.immediate(call_addr, function_address)
-        ret_address = (
-            yield instrs.ArrayIndex(call_addr, Register.pic_table, call_addr)
-        )
+        function_address = ctx.static_allocations[
+            ctx.functions[node.function]
+        ]
+        ctx.load_indexed(body, call_addr, Register.pic_table, function_address)
 
         with ctx.registers.occupy() as imm:
-            # use an orthography instead of immediate to ensure a fixed size
-            # between the address and the place to resume
-            yield instrs.Orthography(imm, ret_address + 6)
-            yield ctx.push(imm)
+            ctx.immediate(body, imm, 0)
+            body.append(instrs.LoadProgram(call_addr, imm))
 
-            yield instrs.Orthography(imm, 0)
-            yield instrs.LoadProgram(call_addr, imm)
+    return_address.value = len(body)
 
     if not expr:
         return None
@@ -265,90 +406,96 @@ def _call(expr, node, ctx):
     out = ctx.registers.occupy()
 
     # we store the return value in the stack array at index 0
-    yield ctx.immediate(out, 0)
-    yield instrs.ArrayIndex(out, Register.stack, out)
+    ctx.load_indexed(body, out, Register.stack, 0)
 
     return out
 
 
 @compile_node.register(ast.Return)
-def _compile_return(node, ctx):
+def _compile_return(node, ctx, body):
     if node.value is None:
         return
 
-    with (yield from compute_into_register(node.value, ctx)) as r, \
-            ctx.registers.occupy() as imm:
+    with compute_into_register(node.value, ctx, body) as r:
         # we store return values in the stack array at index 0
-        yield ctx.immediate(imm, 0)
-        yield instrs.ArrayAmmendment(Register.stack, imm, r)
+        ctx.store_indexed(body, Register.stack, 0, r)
 
 
-@singledispatch
-def compute_into_register(node, ctx):
-    raise NotImplementedError(
-        f'cannot compute node of type {type(node).__name__}: {node!r}',
-    )
+_compute_into_register_impls = {}
+
+
+def compute_into_register(node, ctx, body):
+    try:
+        impl = _compute_into_register_impls[type(node)]
+    except KeyError:
+        raise NotImplementedError(
+            f'cannot compute node of type {type(node).__name__}: {node!r}',
+        )
+
+    return impl(node, ctx, body)
+
+
+compute_into_register.register = partial(
+    _register,
+    _compute_into_register_impls,
+)
 
 
 @compute_into_register.register(ast.Call)
-def _compute_call(node, ctx):
-    return _call(True, node, ctx)
+def _compute_call(node, ctx, body):
+    return _call(True, node, ctx, body)
 
 
 @compute_into_register.register(ast.Local)
 @compute_into_register.register(ast.Argument)
-def _compute_local(node, ctx):
+def _compute_local(node, ctx, body):
     out = ctx.registers.occupy()
-    address = ctx.locals[node]
-    yield ctx.immediate(out, address)
-    yield instrs.ArrayIndex(
-        out,
-        Register.locals,
-        out,
-    )
+    ctx.load_indexed(body, out, Register.locals, node.address)
     return out
 
 
 @compute_into_register.register(ast.Global)
-def _compute_global(node, ctx):
+def _compute_global(node, ctx, body):
     out = ctx.registers.occupy()
 
-    if node.type == 'uint':
-        yield ctx.immediate(out, node.value.value)
+    if node.type is ast.UMLType.uint:
+        ctx.constant(body, out, node.value.value)
     else:
-        yield ctx.immediate(out, ctx.static_address(node))
-        yield instrs.ArrayIndex(out, Register.pic_table, out)
+        ctx.load_indexed(
+            body,
+            out,
+            Register.pic_table,
+            ctx.static_address(node),
+        )
 
     return out
 
 
 @compute_into_register.register(ast.UIntLiteral)
-def _compute_uint_literal(node, ctx):
+def _compute_uint_literal(node, ctx, body):
     out = ctx.registers.occupy()
-    yield ctx.immediate(out, node.value)
+    ctx.constant(body, out, node.value)
     return out
 
 
 @compute_into_register.register(ast.ArrayLiteral)
-def _compute_array_literal(node, ctx):
+def _compute_array_literal(node, ctx, body):
     out = ctx.registers.occupy()
-    yield ctx.immediate(out, ctx.static_address(node))
-    yield instrs.ArrayIndex(out, Register.pic_table, out)
+    ctx.load_indexed(body, out, Register.pic_table, ctx.static_address(node))
     return out
 
 
 @compute_into_register.register(ast.BuiltinCall)
-def _compute_builtin_call(node, ctx):
-    assert node.type != 'void', 'cannot compute void function'
+def _compute_builtin_call(node, ctx, body):
+    assert node.type is not ast.UMLType.void, 'cannot compute void function'
 
-    try:
-        f = _builtins[node.name]
-    except KeyError:
+    f = _builtins.get(node.name)
+    if f is None:
         raise NotImplementedError(
             f'no implementation for built-in {node.name!r}',
         )
 
-    return f(True, node, ctx)
+    return f(True, node, ctx, body)
 
 
 _builtins = {}
@@ -363,111 +510,203 @@ def builtin(f=None, name=None):
 
 
 @builtin
-def putchar(expr, node, ctx):
-    with (yield from compute_into_register(node.args[0], ctx)) as arg:
-        yield instrs.Output(arg)
+def putchar(expr, node, ctx, body):
+    with compute_into_register(node.args[0], ctx, body) as arg:
+        body.append(instrs.Output(arg))
 
 
 @builtin(name='exit')
-def _exit(expr, node, ctx):
-    yield instrs.Halt()
+def _exit(expr, node, ctx, body):
+    body.append(instrs.Halt())
 
 
 @builtin(name='len')
-def _len(expr, node, ctx):
+def _len(expr, node, ctx, body):
     if not expr:
         return
 
-    out = yield from compute_into_register(node.args[0], ctx)
+    out = compute_into_register(node.args[0], ctx, body)
     with ctx.registers.occupy() as zero:
-        yield ctx.immediate(zero, 0)
-        yield instrs.ArrayIndex(out, out, zero)
+        ctx.immediate(body, zero, 0)
+        body.append(instrs.ArrayIndex(out, out, zero))
 
     return out
 
 
 @builtin
-def alloc(expr, node, ctx):
+def alloc(expr, node, ctx, body):
     if not expr:
         # ugh, you can't address this so wtf?
         return
 
-    out = yield from compute_into_register(node.args[0], ctx)
-    yield instrs.Allocation(out, out)
+    out = compute_into_register(node.args[0], ctx, body)
+    body.append(instrs.Allocation(out, out))
     return out
 
 
 @builtin
-def free(expr, node, ctx):
-    with (yield from compute_into_register(node.args[0], ctx)) as r:
-        yield instrs.Abandonment(r)
+def free(expr, node, ctx, body):
+    with compute_into_register(node.args[0], ctx, body) as r:
+        body.append(instrs.Abandonment(r))
 
 
 @compile_node.register(ast.BuiltinCall)
-def _builtin_call(node, ctx):
-    try:
-        f = _builtins[node.name]
-    except KeyError:
+def _builtin_call(node, ctx, body):
+    f = _builtins.get(node.name)
+    if f is None:
         raise NotImplementedError(
             f'no implementation for built-in {node.name!r}',
         )
 
-    return f(False, node, ctx)
+    f(False, node, ctx, body)
+
+
+def _skip_size_word(ctx, body, ix):
+    # arrays store their size at index 0, so add one to move past it; the UM
+    # has no add-immediate, so this is an orthography and an addition
+    with ctx.registers.occupy() as one:
+        ctx.immediate(body, one, 1)
+        body.append(instrs.Addition(ix, ix, one))
 
 
 @compute_into_register.register(ast.Subscript)
-def _compute_subscript(node, ctx):
+def _compute_subscript(node, ctx, body):
     if isinstance(node.index, (ast.Global, ast.UIntLiteral)):
-        out = yield from compute_into_register(node.array, ctx)
+        out = compute_into_register(node.array, ctx, body)
         with ctx.registers.occupy() as ix:
             # add 1 to move past the size
-            yield ctx.immediate(ix, node.index.value + 1)
-            yield instrs.ArrayIndex(out, out, ix)
+            ctx.constant(body, ix, node.index.value + 1)
+            body.append(instrs.ArrayIndex(out, out, ix))
     else:
-        with (yield from compute_into_register(node.index, ctx)) as ix:
-            with ctx.registers.occupy() as imm:
-                # add one to move past the size
-                yield ctx.immediate(imm, 1)
-                yield instrs.Addition(ix, ix, imm)
+        with compute_into_register(node.index, ctx, body) as ix:
+            _skip_size_word(ctx, body, ix)
 
-            out = yield from compute_into_register(node.array, ctx)
-            yield instrs.ArrayIndex(out, out, ix)
+            out = compute_into_register(node.array, ctx, body)
+            body.append(instrs.ArrayIndex(out, out, ix))
 
     return out
 
 
+# The number of registers needed to compute ``node`` (its Sethi-Ullman
+# number), or None if computing it may call a function, in which case it must
+# not be reordered with its siblings.
+def _register_need(node):
+    node_type = type(node)
+    if (node_type is ast.UIntLiteral or
+            node_type is ast.Global or
+            node_type is ast.Local or
+            node_type is ast.Argument or
+            node_type is ast.ArrayLiteral):
+        return 1
+
+    if node_type is ast.BinOp:
+        # fold up the left spine iteratively, like ``_binop``
+        spine = []
+        while type(node) is ast.BinOp:
+            spine.append(node.rhs)
+            node = node.lhs
+
+        lhs = _register_need(node)
+        for rhs_node in reversed(spine):
+            rhs = _register_need(rhs_node)
+            if lhs is None or rhs is None:
+                return None
+            lhs = lhs + 1 if lhs == rhs else max(lhs, rhs)
+        return lhs
+
+    if node_type is ast.UnOp:
+        operand = _register_need(node.operand)
+        return None if operand is None else max(operand, 2)
+
+    if node_type is ast.Subscript:
+        array = _register_need(node.array)
+        index = _register_need(node.index)
+        if array is None or index is None:
+            return None
+        return max(index, array + 1, 2)
+
+    return None
+
+
+_compound_nodes = frozenset({ast.BinOp, ast.UnOp, ast.Subscript})
+
+
+def _rhs_first(node, ctx):
+    # Left to right, the lhs result is held while the rhs runs. When that
+    # would not fit in the free registers and the rhs is the hungrier side,
+    # compute it first so that only one register is held while it runs.
+    # Neither side calls a function, so the evaluation order is not
+    # observable.
+    if type(node.rhs) not in _compound_nodes:
+        return False
+
+    lhs_need = _register_need(node.lhs)
+    rhs_need = _register_need(node.rhs)
+    return (
+        lhs_need is not None and
+        rhs_need is not None and
+        rhs_need > lhs_need and
+        rhs_need + 1 > ctx.registers.available()
+    )
+
+
 @compute_into_register.register(ast.BinOp)
-def _binop(node, ctx):
+def _binop(node, ctx, body):
+    # Walk down the left spine iteratively so that long chains like
+    # ``a + b + c + ...`` don't recurse once per operator. Evaluating a node's
+    # lhs first starts with the same free registers as the node itself, so
+    # the operand order of each node on the spine can be decided up front.
+    spine = []
+    while type(node.lhs) is ast.BinOp and not _rhs_first(node, ctx):
+        spine.append(node)
+        node = node.lhs
+
+    if _rhs_first(node, ctx):
+        rhs = compute_into_register(node.rhs, ctx, body)
+        lhs = compute_into_register(node.lhs, ctx, body)
+        _binop_apply(node.op, lhs, rhs, ctx, body)
+    else:
+        lhs = compute_into_register(node.lhs, ctx, body)
+        _binop_rhs(node, lhs, ctx, body)
+
+    for node in reversed(spine):
+        _binop_rhs(node, lhs, ctx, body)
+
+    return lhs
+
+
+def _binop_rhs(node, lhs, ctx, body):
+    # compute ``node.rhs`` and apply ``node.op`` to the already computed lhs
     if node.op == '-' and isinstance(node.rhs, (ast.Global, ast.UIntLiteral)):
         # small optimization, make this an add of -n
-        lhs = yield from compute_into_register(node.lhs, ctx)
-
         with ctx.registers.occupy() as rhs:
-            yield ctx.immediate(rhs, -node.rhs.value % 2 ** 32)
-            yield instrs.Addition(lhs, lhs, rhs)
-
-        return lhs
+            ctx.constant(body, rhs, -node.rhs.value % 2 ** 32)
+            body.append(instrs.Addition(lhs, lhs, rhs))
+        return
 
-    lhs = yield from compute_into_register(node.lhs, ctx)
-    with (yield from compute_into_register(node.rhs, ctx)) as rhs:
-        if node.op == '+':
-            yield instrs.Addition(lhs, lhs, rhs)
-        elif node.op == '-':
-            yield instrs.NotAnd(rhs, rhs, rhs)
-            yield instrs.Addition(lhs, lhs, rhs)
-        elif node.op == '*':
-            yield instrs.Multiplication(lhs, lhs, rhs)
-        elif node.op == '/':
-            yield instrs.Division(lhs, lhs, rhs)
+    rhs = compute_into_register(node.rhs, ctx, body)
+    _binop_apply(node.op, lhs, rhs, ctx, body)
+
+
+def _binop_apply(op, lhs, rhs, ctx, body):
+    # store ``lhs <op> rhs`` in lhs, releasing rhs
+    with rhs:
+        if op == '+':
+            body.append(instrs.Addition(lhs, lhs, rhs))
+        elif op == '-':
+            body.append(instrs.NotAnd(rhs, rhs, rhs))
+            body.append(instrs.Addition(lhs, lhs, rhs))
+        elif op == '*':
+            body.append(instrs.Multiplication(lhs, lhs, rhs))
+        elif op == '/':
+            body.append(instrs.Division(lhs, lhs, rhs))
         else:
-            raise NotImplementedError(f'op {node.op} not supported')
+            raise NotImplementedError(f'op {op} not supported')
 
-    if node.op == '-':
+    if op == '-':
         with ctx.registers.occupy() as imm:
-            yield ctx.immediate(imm, 1)
-            yield instrs.Addition(lhs, lhs, imm)
-
-    return lhs
+            ctx.immediate(body, imm, 1)
+            body.append(instrs.Addition(lhs, lhs, imm))
 
 
 _unop_funcs = {
@@ -478,92 +717,94 @@ _unop_funcs = {
 
 
 @compute_into_register.register(ast.UnOp)
-def _unop(node, ctx):
+def _unop(node, ctx, body):
     if node.op == '+':
         # nop
-        return compute_into_register(node.operand, ctx)
+        return compute_into_register(node.operand, ctx, body)
 
     if isinstance(node.operand, (ast.Global, ast.UIntLiteral)):
         out = ctx.registers.occupy()
         try:
-            yield ctx.immediate(_unop_funcs[node.op](node.operand))
+            ctx.immediate(body, _unop_funcs[node.op](node.operand))
         except KeyError:
             raise NotImplementedError(f'op {node.op} not supported')
         return out
 
-    out = yield from compute_into_register(node.operand, ctx)
+    out = compute_into_register(node.operand, ctx, body)
     if node.op == '-':
-        yield instrs.NotAnd(out, out, out)
+        body.append(instrs.NotAnd(out, out, out))
         with ctx.registers.occupy() as imm:
-            yield ctx.immediate(imm, 1)
-            yield instrs.Addition(out, out, imm)
+            ctx.immediate(body, imm, 1)
+            body.append(instrs.Addition(out, out, imm))
     elif node.op == '~':
-        yield instrs.NotAnd(out, out, out)
+        body.append(instrs.NotAnd(out, out, out))
     elif node.op == 'not':
         with ctx.registers.occupy() as false:
-            yield ctx.immediate(false, 0)
+            ctx.immediate(body, false, 0)
             # write a false to out iff out is true
-            yield instrs.ConditionalMove(out, false, out)
+            body.append(instrs.ConditionalMove(out, false, out))
 
     return out
 
 
-def _assign_name(node, ctx):
-    with (yield from compute_into_register(node.rhs, ctx)) as rhs:
-        address = ctx.locals[node.lhs]
-        with ctx.registers.occupy() as address_register:
-            yield ctx.immediate(address_register, address)
-            yield instrs.ArrayAmmendment(
-                Register.locals,
-                address_register,
-                rhs,
-            )
+def _assign_name(node, ctx, body):
+    with compute_into_register(node.rhs, ctx, body) as rhs:
+        ctx.store_indexed(body, Register.locals, node.lhs.address, rhs)
 
 
-def _assign_subscript(node, ctx):
+def _assign_subscript(node, ctx, body):
     if isinstance(node.lhs.index, (ast.Global, ast.UIntLiteral)):
-        with (yield from compute_into_register(node.lhs.array, ctx)) as arr, \
+        with compute_into_register(node.lhs.array, ctx, body) as arr, \
                 ctx.registers.occupy() as ix:
             # add 1 to move past the size
-            yield ctx.immediate(ix, node.lhs.index.value + 1)
-            with (yield from compute_into_register(node.rhs, ctx)) as rhs:
-                yield instrs.ArrayAmmendment(arr, ix, rhs)
+            ctx.constant(body, ix, node.lhs.index.value + 1)
+            with compute_into_register(node.rhs, ctx, body) as rhs:
+                body.append(instrs.ArrayAmmendment(arr, ix, rhs))
 
     else:
-        with (yield from compute_into_register(node.lhs.array, ctx)) as arr, \
-                (yield from compute_into_register(node.lhs.index, ctx)) as ix:
-            with ctx.registers.occupy() as imm:
-                # add 1 to move past the size
-                yield ctx.immediate(1)
-                yield instrs.Addition(ix, ix, imm)
-            with (yield from compute_into_register(node.rhs, ctx)) as rhs:
-                yield instrs.ArrayAmmendment(arr, ix, rhs)
+        with compute_into_register(node.lhs.array, ctx, body) as arr, \
+                compute_into_register(node.lhs.index, ctx, body) as ix:
+            _skip_size_word(ctx, body, ix)
+            with compute_into_register(node.rhs, ctx, body) as rhs:
+                body.append(instrs.ArrayAmmendment(arr, ix, rhs))
 
 
 @compile_node.register(ast.Assignment)
-def _assignment(node, ctx):
+def _assignment(node, ctx, body):
     if isinstance(node.lhs, ast.Subscript):
-        return _assign_subscript(node, ctx)
-
-    return _assign_name(node, ctx)
+        _assign_subscript(node, ctx, body)
+    else:
+        _assign_name(node, ctx, body)
 
 
-def _write_static_allocations(ctx, static_allocations):
+def _write_static_allocations(ctx, static_allocations, body):
     with ctx.registers.occupy() as imm:
-        yield ctx.immediate(imm, len(static_allocations))
-        yield instrs.Allocation(Register.pic_table, imm)
+        ctx.immediate(body, imm, len(static_allocations))
+        body.append(instrs.Allocation(Register.pic_table, imm))
 
     with ctx.registers.occupy() as imm:
-        yield ctx.immediate(imm, STACK_SIZE)
-        yield instrs.Allocation(Register.stack, imm)
+        ctx.immediate(body, imm, STACK_SIZE)
+        body.append(instrs.Allocation(Register.stack, imm))
 
     # the stack top is 1 because we store the return at index 0
-    yield ctx.immediate(Register.stack_top, 1)
+    ctx.immediate(body, Register.stack_top, 1)
+
+    main_address = None
 
-    def inner_write_static_allocations():
-        main = None
+    # Function bodies are mostly words above the orthography limit, which
+    # are built as quot * max_value + rem; keep max_value in a register for
+    # the whole prologue instead of rebuilding it for every word.
+    with ctx.registers.occupy() as scale:
+        body.append(instrs.Orthography(scale, instrs.Orthography.max_value))
 
         for node, address in static_allocations.items():
+            if type(node) is ast.UIntLiteral:
+                # hoisted constants are stored in the table directly
+                with ctx.registers.occupy() as imm:
+                    ctx.immediate(body, imm, node.value)
+                    ctx.store_indexed(body, Register.pic_table, address, imm)
+                continue
+
             if isinstance(node, (ast.FunctionDef, ast.IfBranch)):
                 data = [
                     instr.raw_instruction
@@ -576,69 +817,56 @@ def _write_static_allocations(ctx, static_allocations):
                 alloc_size = len(data) + 1  # we store the size inline
                 offset = 1
 
-            array = ctx.registers.occupy()
-            with ctx.registers.occupy() as size_reg:
-                yield ctx.immediate(size_reg, alloc_size)
-                yield instrs.Allocation(array, size_reg)
-
-            if not isinstance(node, ast.FunctionDef):
-                with ctx.registers.occupy() as imm:
-                    yield ctx.immediate(imm, len(data))
-                    with ctx.registers.occupy() as ix:
-                        yield ctx.immediate(ix, 0)
-                        yield instrs.ArrayAmmendment(
-                            array,
-                            ix,
-                            imm,
-                        )
-
-            for n, raw_instruction in enumerate(data, offset):
-                with ctx.registers.occupy() as imm:
-                    yield ctx.immediate(imm, raw_instruction)
-                    with ctx.registers.occupy() as ix:
-                        yield ctx.immediate(ix, n)
-                        yield instrs.ArrayAmmendment(
-                            array,
-                            ix,
-                            imm,
-                        )
-
-            with ctx.registers.occupy() as ix:
-                yield ctx.immediate(ix, address)
-                yield instrs.ArrayAmmendment(Register.pic_table, ix, array)
-
-            if isinstance(node, ast.FunctionDef) and node.name == 'main':
-                main = array
-            else:
-                array.release()
-
-        return main
+            with ctx.registers.occupy() as array:
+                with ctx.registers.occupy() as size_reg:
+                    ctx.immediate(body, size_reg, alloc_size)
+                    body.append(instrs.Allocation(array, size_reg))
 
-    main = yield from inner_write_static_allocations()
-    if main is None:
-        raise SyntaxError('no main function')
+                if offset:
+                    with ctx.registers.occupy() as imm:
+                        ctx.immediate(body, imm, len(data))
+                        ctx.store_indexed(body, array, 0, imm)
 
-    with ctx.registers.occupy() as imm:
-        yield ctx.immediate(imm, 0)
-        yield instrs.LoadProgram(main, imm)
+                _store_words(ctx, body, array, data, offset, scale)
 
+                ctx.store_indexed(body, Register.pic_table, address, array)
 
-def _ll_instrs(it):
-    ip = 0
+            if isinstance(node, ast.FunctionDef) and node.name == 'main':
+                main_address = address
 
-    for llinstr in next(it).low_level_instructions():
-        ip += 1
-        yield llinstr
+    if main_address is None:
+        raise SyntaxError('no main function')
 
-    while True:
-        try:
-            ir = it.send(ip)
-        except StopIteration:
-            return
+    with ctx.registers.occupy() as main, ctx.registers.occupy() as imm:
+        ctx.load_indexed(body, main, Register.pic_table, main_address)
+        ctx.immediate(body, imm, 0)
+        body.append(instrs.LoadProgram(main, imm))
+
+
+def _store_words(ctx, body, array, words, offset, scale):
+    # this runs once per word of every function body; keep the lookups out of
+    # the loop
+    occupy = ctx.registers.occupy
+    immediate = ctx.immediate
+    emit = body.append
+    Orthography = instrs.Orthography
+    max_value = Orthography.max_value
+
+    for n, word in enumerate(words, offset):
+        with occupy() as value, occupy() as ix:
+            quot, rem = divmod(word, max_value)
+            if quot:
+                emit(Orthography(value, quot))
+                emit(instrs.Multiplication(value, scale, value))
+                if rem:
+                    # use the index register as scratch before it is set
+                    emit(Orthography(ix, rem))
+                    emit(instrs.Addition(value, ix, value))
+            else:
+                emit(Orthography(value, rem))
 
-        for llinstr in ir.low_level_instructions():
-            ip += 1
-            yield llinstr
+            immediate(body, ix, n)
+            emit(instrs.ArrayAmmendment(array, ix, value))
 
 
 def compile_ast(nodes):
@@ -646,15 +874,20 @@ def compile_ast(nodes):
         _static_allocations_without_literal_arrays(nodes),
     )
     function_bodies = {}
-    ctx = Context(static_allocations, function_bodies)
+    functions = {
+        node.name: node
+        for node in nodes
+        if isinstance(node, ast.FunctionDef)
+    }
+    ctx = Context(static_allocations, function_bodies, functions)
     for node in nodes:
         if isinstance(node, ast.FunctionDef):
-            function_bodies[node] = list(_ll_instrs(compile_node(node, ctx)))
-
-    return b''.join(
-        ll.raw_instruction.to_bytes(4, 'big')
-        for ll in _ll_instrs(_write_static_allocations(
-            ctx,
-            static_allocations,
-        ))
+            function_bodies[node] = function_body = []
+            compile_node(node, ctx, function_body)
+
+    body = []
+    _write_static_allocations(ctx, static_allocations, body)
+    return struct.pack(
+        f'>{len(body)}I',
+        *(ll.raw_instruction for ll in body),
     )
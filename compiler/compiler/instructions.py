@@ -1,9 +1,9 @@
 from operator import index
 
-from .runtime_constants import Register
-
 
 class Address:
+    __slots__ = 'value',
+
     def __init__(self, value=None):
         self.value = value
 
@@ -15,149 +15,169 @@ class Address:
         return value
 
 
-def set_bits(n, start, count, value):
-    """Set the bits in ``out`` from [start,start + count) to value.
+class _BaseInstruction:
+    # the behavior shared by every machine instruction; the operand slots are
+    # left to the subclasses so that ``Orthography`` doesn't carry a, b and c
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        opcode = cls.__dict__.get('opcode')
+        if opcode is not None:
+            # the opcode lives in the top 4 bits of every instruction
+            cls._opcode_bits = opcode << 28
+
+    @property
+    def output_register(self):
+        output = self.output
+        return None if output is None else getattr(self, output)
+
+    def low_level_instructions(self):
+        yield self
 
-    Parameters
-    ----------
-    n : int
-        The int to set the bits of.
-    start : int
-        The start bit to set.
-    count : int
-        The number of bits to set.
-    value : int
-        The bitpattern to set.
 
-    Returns
-    -------
-    set : int
-        ``n`` with the bits set.
-    """
-    mask = ~(((1 << count) - 1) << start)
-    return (n & mask) | (value << start)
+class Instruction(_BaseInstruction):
+    __slots__ = 'a', 'b', 'c'
 
+    # the name of the field holding the register this instruction writes to,
+    # or None if it doesn't write to a register
+    output = 'a'
 
-class Instruction:
     def __init__(self, a=0, b=0, c=0):
-        self.a = a
-        self.b = b
-        self.c = c
+        # registers may be handed in as allocator handles; resolve them once
+        # here so that encoding and inspection only ever see ints
+        self.a = index(a)
+        self.b = index(b)
+        self.c = index(c)
 
     @property
     def raw_instruction(self):
-        instruction = set_bits(0, 28, 4, self.opcode)
-        instruction = set_bits(instruction, 6, 3, index(self.a))
-        instruction = set_bits(instruction, 3, 3, index(self.b))
-        instruction = set_bits(instruction, 0, 3, index(self.c))
-        return instruction
-
-    def low_level_instructions(self):
-        yield self
+        return self._opcode_bits | self.a << 6 | self.b << 3 | self.c
 
     def __repr__(self):
         return f'{type(self).__name__}(a={self.a}, b={self.b}, c={self.c})'
 
 
 class ConditionalMove(Instruction):
+    __slots__ = ()
     opcode = 0
 
 
 class ArrayIndex(Instruction):
+    __slots__ = ()
     opcode = 1
 
 
 class ArrayAmmendment(Instruction):
+    __slots__ = ()
     opcode = 2
+    output = None
 
 
 class Addition(Instruction):
+    __slots__ = ()
     opcode = 3
 
 
 class Multiplication(Instruction):
+    __slots__ = ()
     opcode = 4
 
 
 class Division(Instruction):
+    __slots__ = ()
     opcode = 5
 
 
 class NotAnd(Instruction):
+    __slots__ = ()
     opcode = 6
 
 
 class Halt(Instruction):
+    __slots__ = ()
     opcode = 7
+    output = None
 
     def __init__(self):
         super().__init__(0, 0, 0)
 
 
 class Allocation(Instruction):
+    __slots__ = ()
     opcode = 8
+    output = 'b'
 
     def __init__(self, result, size):
         super().__init__(0, result, size)
 
 
 class Abandonment(Instruction):
+    __slots__ = ()
     opcode = 9
+    output = None
 
     def __init__(self, register):
         super().__init__(0, 0, register)
 
 
 class Output(Instruction):
+    __slots__ = ()
     opcode = 10
+    output = None
 
     def __init__(self, register):
         super().__init__(0, 0, register)
 
 
 class Input(Instruction):
+    __slots__ = ()
     opcode = 11
+    output = 'c'
 
 
 class LoadProgram(Instruction):
+    __slots__ = ()
     opcode = 12
+    output = None
 
     def __init__(self, program, ip):
         super().__init__(0, program, ip)
 
 
-class Orthography(Instruction):
+class Orthography(_BaseInstruction):
+    __slots__ = 'register', 'value'
     opcode = 13
+    output = 'register'
     max_value = 2 ** 25 - 1
 
     def __init__(self, register, value):
-        if value > self.max_value:
+        # an ``Address`` may be filled in after the instruction is emitted
+        if not isinstance(value, Address) and value > self.max_value:
             raise ValueError(
                 f'cannot store an immediate larger'
                 f' than {self.max_value}: {value}',
             )
 
-        self.register = register
+        self.register = index(register)
         self.value = value
 
     @property
     def raw_instruction(self):
-        instruction = set_bits(0, 28, 4, self.opcode)
-        instruction = set_bits(instruction, 25, 3, index(self.register))
-        instruction = set_bits(instruction, 0, 25, index(self.value))
-        return instruction
+        return self._opcode_bits | self.register << 25 | index(self.value)
 
     def __repr__(self):
         return f'{type(self).__name__}({self.register}, {self.value})'
 
 
 class IRInstruction(object):
-    def low_level_instructions(self):
-        for instr in self.instructions:
-            yield from instr.low_level_instructions()
+    # subclasses implement ``low_level_instructions`` to lower themselves
+    __slots__ = ()
 
 
 class Immediate(IRInstruction):
+    __slots__ = 'register', 'value', 'allocator'
+
     def __init__(self, register, value, register_allocator):
         self.register = register
         self.value = value
@@ -168,6 +188,18 @@ class Immediate(IRInstruction):
         register = self.register
         value = index(self.value)
 
+        if value <= Orthography.max_value:
+            yield Orthography(register, value)
+            return
+
+        complement = ~value & 0xffffffff
+        if complement <= Orthography.max_value:
+            # values close to 2 ** 32, like negative numbers, are the bitwise
+            # complement of a small value
+            yield Orthography(register, complement)
+            yield NotAnd(register, register, register)
+            return
+
         quot, rem = divmod(value, Orthography.max_value)
         if quot:
             yield Orthography(register, quot)
@@ -181,43 +213,3 @@ class Immediate(IRInstruction):
                     yield Addition(register, r, register)
         else:
             yield Orthography(register, rem)
-
-
-class Push(IRInstruction):
-    def __init__(self, register, register_allocator):
-        self.register = register
-        self.allocator = register_allocator
-
-    def low_level_instructions(self):
-        yield ArrayAmmendment(
-            Register.stack,
-            Register.stack_top,
-            self.register,
-        )
-
-        register_allocator = self.allocator
-        with register_allocator.occupy() as imm:
-            yield from Immediate(
-                imm,
-                1,
-                register_allocator,
-            ).low_level_instructions()
-            yield Addition(Register.stack_top, Register.stack_top, imm)
-
-
-class Pop(IRInstruction):
-    def __init__(self, register, register_allocator):
-        self.register = register
-        self.allocator = register_allocator
-
-    def low_level_instructions(self):
-        register_allocator = self.allocator
-        with register_allocator.occupy() as imm:
-            yield from Immediate(
-                imm,
-                -1 % 2 ** 32,
-                register_allocator,
-            ).low_level_instructions()
-            yield Addition(Register.stack_top, Register.stack_top, imm)
-
-        yield ArrayIndex(self.register, Register.stack, Register.stack_top)
@@ -1,10 +1,10 @@
-import enum
-
-
 STACK_SIZE = 2 ** 10
 
 
-class Register(enum.IntEnum):
+class Register:
+    """The machine's registers. These are plain ints rather than an IntEnum
+    so that register operands stay exact ints all the way through encoding.
+    """
     # scratch registers
     ax = 0
     bx = 1